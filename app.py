@@ -1,65 +1,305 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, abort
+from flask import Flask, request, jsonify, send_from_directory, Response, abort
 from ultralytics import YOLO
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 import requests   # <-- REQUIRED
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-import random
+import shutil
+import tempfile
+import re
+from urllib.parse import quote
+import types
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 import uuid
 import time
 import threading
+import queue
+import collections
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import numpy as np
+import cv2
+import torch
 
 # ================================================================
-# 🔶 ORIGINAL BACKEND CONFIG (unchanged)
+# 🔶 BACKEND CONFIG
 # ================================================================
+# Log records are queued and written by a background listener thread,
+# so request threads never block on stdout.
+LOG_QUEUE = queue.Queue(-1)
+QueueListener(LOG_QUEUE, logging.StreamHandler()).start()
+logging.getLogger().addHandler(QueueHandler(LOG_QUEUE))
+logging.getLogger().setLevel(logging.INFO)
+log = logging.getLogger("stagenix")
+
 app = Flask(
     __name__,
     static_folder="public",
     static_url_path=""
 )
 
-MODEL_URL = "https://github.com/Harsha-k04/Stagenix-backend/releases/download/v1.0/perfect_stage_corrected.glb?raw=1"
+class OrjsonProvider(DefaultJSONProvider):
+    """Route jsonify() through orjson; it's much faster on large detection payloads."""
+
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
+
+
+app.json = OrjsonProvider(app)
+# App-wide request body cap, sized for worker GLB uploads to /job/<id>/complete;
+# the image routes enforce the much smaller MAX_IMAGE_UPLOAD themselves
+app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024
+MAX_IMAGE_UPLOAD = 20 * 1024 * 1024
+
+
+def image_upload_too_large():
+    """Check before touching request.files, so oversized bodies are never parsed."""
+    length = request.content_length
+    if length is not None and length > MAX_IMAGE_UPLOAD:
+        return jsonify({"error": "upload too large"}), 413
+    return None
 
+MODEL_URL = "https://github.com/Harsha-k04/Stagenix-backend/releases/download/v1.0/perfect_stage_corrected.glb?raw=1"
+MODEL_PATH = os.path.join("model_cache", "perfect_stage_corrected.glb")
+MODEL_FETCH_LOCK = threading.Lock()
+MODEL_FETCH_TIMEOUT = (5, 30)   # (connect, read) seconds; the fetch holds MODEL_FETCH_LOCK
+STATIC_MAX_AGE = 86400   # browser cache for the stage GLB and /assets
+
+# Pooled keep-alive session for outbound fetches (skips a TCP+TLS handshake per call)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
+# flask-cors only on the JSON API; static routes get a plain header in static_cors()
+CORS_API = {"origins": "*"}
 CORS(
     app,
-    resources={r"/*": {"origins": "*"}},
+    resources={
+        r"/ping": CORS_API,
+        r"/predict": CORS_API,
+        r"/generate": CORS_API,
+        r"/status/*": CORS_API,
+        r"/result/*": CORS_API,
+        r"/job/*": CORS_API,
+        r"/api/*": CORS_API,
+    },
     allow_headers=["Content-Type", "Authorization"],
     expose_headers=["Content-Type", "Authorization"],
     supports_credentials=True
 )
 
-model = YOLO("yolov8l-seg.pt")
+STATIC_CORS_PREFIXES = ("/uploads/", "/assets/", "/model/")
+
+
+@app.after_request
+def static_cors(response):
+    # Cheap single header for the static routes; also covers their 404/500 responses
+    if request.path.startswith(STATIC_CORS_PREFIXES):
+        response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+# ---- YOLO inference settings: FP16 on CUDA, FP32 on CPU ----
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+HALF = DEVICE == "cuda"
+IMGSZ = 640
+MAX_BATCH = 8            # max images coalesced into one forward pass
+BATCH_WAIT = 0.005       # seconds to wait for more images after the first
+
+MODEL_WEIGHTS = "yolov8l-seg.pt"
+ENGINE_WEIGHTS = "yolov8l-seg.engine"   # TensorRT (CUDA only)
+ONNX_WEIGHTS = "yolov8l-seg.onnx"       # onnxruntime fallback
+
+
+# Exported weights are built once, offline, with the Ultralytics CLI (a TensorRT
+# build takes minutes and must not run while gunicorn is booting the worker):
+#   yolo export model=yolov8l-seg.pt format=engine half=True dynamic=True batch=8 imgsz=640 device=0
+#   yolo export model=yolov8l-seg.pt format=onnx simplify=True dynamic=True batch=8 imgsz=640
+def load_model():
+    # Prefer a prebuilt engine, then ONNX, then the PyTorch checkpoint
+    if DEVICE == "cuda" and os.path.exists(ENGINE_WEIGHTS):
+        return YOLO(ENGINE_WEIGHTS, task="segment")
+    if os.path.exists(ONNX_WEIGHTS):
+        return YOLO(ONNX_WEIGHTS, task="segment")
+
+    m = YOLO(MODEL_WEIGHTS)
+    if HALF:
+        m.to(DEVICE).half()
+    return m
+
+
+MODEL = None
+MODEL_LOCK = threading.Lock()
+
+
+def get_model():
+    """Load and warm up YOLO once for this module object.
+
+    Called eagerly at import so warmup finishes before the first request; the
+    guard only stops repeat loads from within this module. Running
+    ``python app.py`` and then ``import app`` still creates two module objects
+    (``__main__`` and ``app``) and so two models.
+    """
+    global MODEL
+    if MODEL is None:
+        with MODEL_LOCK:
+            if MODEL is None:
+                m = load_model()
+                # Warmup so cuDNN autotune + FP16 kernels are picked before the first request
+                m(np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8), imgsz=IMGSZ, device=DEVICE, half=HALF, verbose=False)
+                MODEL = m
+    return MODEL
+
+
+get_model()
+
+# Ephemeral image/sketch uploads go to a scratch dir, on tmpfs when available.
+# The committed files in uploads/ are still served from there, never expired.
+STATIC_UPLOADS_DIR = "uploads"
+UPLOAD_DIR = os.environ.get(
+    "UPLOAD_DIR",
+    "/dev/shm/stagenix" if os.path.isdir("/dev/shm")
+    else os.path.join(tempfile.gettempdir(), "stagenix")
+)
+UPLOAD_TTL = 10 * 60   # seconds before the janitor removes an upload
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# path -> write time; the janitor only ever deletes files recorded here
+UPLOADED = {}
+
+
+def _track_upload(path):
+    UPLOADED[path] = time.time()
+
 
-os.makedirs("uploads", exist_ok=True)
+def _upload_janitor():
+    while True:
+        cutoff = time.time() - UPLOAD_TTL
+        for path, written_at in list(UPLOADED.items()):
+            if written_at >= cutoff:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            UPLOADED.pop(path, None)
+        time.sleep(60)
 
+
+threading.Thread(target=_upload_janitor, daemon=True).start()
+
+# ================================================================
+# 🔍 Helper: micro-batching inference worker
 # ================================================================
-# 🔍 Helper: Simple keyword-based scene generator (unchanged)
+INFER_QUEUE = queue.Queue()
+
+
+def _inference_worker():
+    while True:
+        batch = [INFER_QUEUE.get()]
+        deadline = time.monotonic() + BATCH_WAIT
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(INFER_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            model = get_model()
+            results = model([item[0] for item in batch], imgsz=IMGSZ, device=DEVICE, half=HALF, verbose=False)
+            for (_, _, slot), res in zip(batch, results):
+                slot["result"] = res.tojson()
+        except Exception as e:
+            for _, _, slot in batch:
+                slot["error"] = e
+
+        for _, done, _ in batch:
+            done.set()
+
+
+def run_inference(img):
+    """Queue one image for the batching worker and block until its detections are ready."""
+    done = threading.Event()
+    slot = {}
+    INFER_QUEUE.put((img, done, slot))
+    done.wait()
+    if "error" in slot:
+        raise slot["error"]
+    return slot["result"]
+
+
+threading.Thread(target=_inference_worker, daemon=True).start()
+
+
+def _write_file(path, data, errors):
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+    except OSError as e:
+        log.warning("failed to write upload %s: %s", path, e)
+        errors.append(e)
+        return
+    _track_upload(path)
+
+
 # ================================================================
+# 🔍 Helper: Simple keyword-based scene generator
+# ================================================================
+OBJECT_LIBRARY = types.MappingProxyType({
+    "plant": "pottedplant",
+    "tree": "pottedplant",
+    "vase": "vase",
+    "chair": "chair",
+    "table": "table",
+    "lamp": "lamp",
+    "sofa": "sofa",
+    "carpet": "carpet",
+    "stage": "stage",
+    "wedding": "wedding",
+})
+
+# One alternation scans the prompt once instead of one substring search per keyword.
+# The lookahead makes matches zero-width so overlapping keywords ("carpetree") all hit.
+OBJECT_PATTERN = re.compile("(?=(%s))" % "|".join(map(re.escape, OBJECT_LIBRARY)))
+OBJECT_NAMES = tuple(dict.fromkeys(OBJECT_LIBRARY.values()))   # unique, library order
+RNG = np.random.default_rng()
+
+
 def generate_objects_from_prompt(prompt: str):
     prompt = prompt.lower()
 
-    object_library = {
-        "plant": "pottedplant",
-        "tree": "pottedplant",
-        "vase": "vase",
-        "chair": "chair",
-        "table": "table",
-        "lamp": "lamp",
-        "sofa": "sofa",
-        "carpet": "carpet",
-        "stage": "stage",
-        "wedding": "wedding",
-    }
+    hits = {OBJECT_LIBRARY[m] for m in OBJECT_PATTERN.findall(prompt)}
+
+    names = [obj_name for obj_name in OBJECT_NAMES if obj_name in hits]
+    positions = RNG.uniform(-1, 1, (len(names), 2)).tolist()
 
-    objects = []
-    for keyword, obj_name in object_library.items():
-        if keyword in prompt:
-            objects.append({
-                "name": obj_name,
-                "position": [random.uniform(-1, 1), 0, random.uniform(-1, 1)],
-                "rotation": [0, 0, 0]
-            })
+    objects = [
+        {"name": n, "position": [p[0], 0, p[1]], "rotation": [0, 0, 0]}
+        for n, p in zip(names, positions)
+    ]
 
     if not objects:
         objects.append({
@@ -72,31 +312,61 @@ def generate_objects_from_prompt(prompt: str):
 
 
 # ================================================================
-# 🔶 ORIGINAL ROUTES (unchanged)
+# 🔶 STAGE MODEL CACHE + CORE ROUTES
 # ================================================================
-@app.route("/model/perfect_stage_corrected.glb")
-def serve_model():
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Accept": "*/*"
-    }
+def fetch_model_glb():
+    """Download the stage GLB from GitHub once; later calls are no-ops."""
+    if os.path.exists(MODEL_PATH):
+        return
+    with MODEL_FETCH_LOCK:
+        if os.path.exists(MODEL_PATH):
+            return
+        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+        headers = {
+            "User-Agent": "Mozilla/5.0",
+            "Accept": "*/*"
+        }
+        r = SESSION.get(
+            MODEL_URL, headers=headers, stream=True, allow_redirects=True,
+            timeout=MODEL_FETCH_TIMEOUT
+        )
+        with r:   # release the pooled connection on every path
+            if r.status_code != 200:
+                raise RuntimeError(f"GitHub returned {r.status_code}")
+
+            tmp_path = MODEL_PATH + ".tmp"
+            r.raw.decode_content = True
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(r.raw, f, length=1 << 20)
+        os.replace(tmp_path, MODEL_PATH)
 
+
+# Warm the GLB cache in the background so the first client doesn't pay for it
+def _prefetch_model_glb():
     try:
-        r = requests.get(MODEL_URL, headers=headers, stream=True, allow_redirects=True)
+        fetch_model_glb()
+    except Exception as e:
+        log.warning("GLB prefetch failed: %s", e)
 
-        if r.status_code != 200:
-            return {"error": f"GitHub returned {r.status_code}"}, 500
 
-        response = Response(
-            stream_with_context(r.iter_content(chunk_size=8192)),
-            content_type="model/gltf-binary"
-        )
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        return response
+threading.Thread(target=_prefetch_model_glb, daemon=True).start()
+
 
+@app.route("/model/perfect_stage_corrected.glb")
+def serve_model():
+    try:
+        fetch_model_glb()
     except Exception as e:
         return {"error": str(e)}, 500
 
+    return send_from_directory(
+        os.path.dirname(MODEL_PATH),
+        os.path.basename(MODEL_PATH),
+        mimetype="model/gltf-binary",
+        conditional=True,
+        max_age=STATIC_MAX_AGE
+    )
+
 
 @app.route("/ping")
 def ping():
@@ -105,21 +375,37 @@ def ping():
 
 @app.route("/predict", methods=["POST"])
 def predict():
+    too_large = image_upload_too_large()
+    if too_large:
+        return too_large
+
     response = {}
 
     if "image" in request.files:
         img = request.files["image"]
-        img_path = os.path.join("uploads", secure_filename(img.filename))
-        img.save(img_path)
+        filename = secure_filename(img.filename) or f"{uuid.uuid4().hex}.jpg"
+        img_path = os.path.join(UPLOAD_DIR, filename)
+
+        # Decode once in-process instead of saving and letting YOLO re-read the file
+        data = img.read()
+        arr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if arr is None:
+            return jsonify({"error": "Could not decode image"}), 400
 
-        results = model(img_path)
-        detections = results[0].tojson()
+        # segmented_image is served from /uploads: write it while inference runs,
+        # and wait for the write before handing out the URL
+        write_errors = []
+        writer = threading.Thread(target=_write_file, args=(img_path, data, write_errors))
+        writer.start()
+
+        detections = run_inference(arr)
+        writer.join()
 
         response = {
             "status": "ok",
             "source": "image",
             "results": detections,
-            "segmented_image": f"/uploads/{secure_filename(img.filename)}"
+            "segmented_image": None if write_errors else f"/uploads/{filename}"
         }
 
     elif "prompt" in request.form:
@@ -136,18 +422,56 @@ def predict():
     else:
         return jsonify({"error": "No image or prompt provided"}), 400
 
-    print("Response:", response)
+    log.info("response source=%s", response.get("source"))
     return jsonify(response)
 
 
+# Behind nginx, set ACCEL_REDIRECT=1 and let nginx sendfile() these directly.
+# nginx drops most upstream headers on an internal redirect, so CORS and
+# caching have to be configured on the internal locations themselves:
+#   location /__internal_uploads/ {
+#       internal; alias /dev/shm/stagenix/; sendfile on;
+#       add_header Access-Control-Allow-Origin *;
+#   }
+#   location /__internal_static_uploads/ {
+#       internal; alias /srv/stagenix/uploads/; sendfile on;
+#       add_header Access-Control-Allow-Origin *;
+#   }
+#   location /__internal_assets/ {
+#       internal; alias /srv/stagenix/public/assets/; sendfile on;
+#       add_header Access-Control-Allow-Origin *; expires 1d;
+#   }
+# Under plain gunicorn, send_from_directory already uses its wsgi.file_wrapper (sendfile).
+ACCEL_REDIRECT = os.environ.get("ACCEL_REDIRECT") == "1"
+
+
+def serve_static(directory, internal_prefix, filename, max_age=None):
+    if ACCEL_REDIRECT:
+        if safe_join(directory, filename) is None:
+            abort(404)
+        response = Response()
+        response.headers["X-Accel-Redirect"] = f"{internal_prefix}/{quote(filename)}"
+        # Let nginx pick the type from the file instead of Flask's text/html default
+        del response.headers["Content-Type"]
+        if max_age is not None:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+    else:
+        response = send_from_directory(directory, filename, conditional=True, max_age=max_age)
+    return response
+
+
 @app.route("/uploads/<path:filename>")
 def uploads(filename):
-    return send_from_directory("uploads", filename)
+    scratch = safe_join(UPLOAD_DIR, filename)
+    if not (scratch and os.path.isfile(scratch)):
+        return serve_static(STATIC_UPLOADS_DIR, "/__internal_static_uploads", filename)
+    return serve_static(UPLOAD_DIR, "/__internal_uploads", filename)
 
 
 @app.route("/assets/<path:filename>")
 def assets(filename):
-    return send_from_directory("public/assets", filename)
+    return serve_static("public/assets", "/__internal_assets", filename, max_age=STATIC_MAX_AGE)
 
 
 @app.route("/")
@@ -159,11 +483,24 @@ def home():
 # 🔶 MERGED: KAGGLE WORKER QUEUE SYSTEM
 # ================================================================
 
-UPLOAD_DIR = "generated_models"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+GENERATED_DIR = "generated_models"
+os.makedirs(GENERATED_DIR, exist_ok=True)
 
+# Single-key get/set on a dict is atomic in CPython, so JOBS needs no global
+# lock; each job's state transitions are guarded by its own lock instead.
+# Readers don't take that lock, so every transition assigns "status" last:
+# once a reader sees a status, the fields belonging to it are already set.
 JOBS = {}
-JOBS_LOCK = threading.Lock()
+JOB_LOCKS = {}
+MAX_JOBS = 10000    # hard cap on tracked jobs, queued ones included
+JOB_TTL = 60 * 60   # seconds a finished job (and its GLB) is kept
+JOB_RUN_TIMEOUT = 30 * 60   # a running job whose worker went silent this long is failed
+JOB_QUEUE_TTL = 60 * 60     # a job nobody claimed this long is failed
+QUEUED = collections.deque()   # FIFO of queued job ids
+FINISHED = collections.deque()  # job ids in the order they finished, for eviction
+EVICT_LOCK = threading.Lock()
+JOB_CV = threading.Condition()  # wakes long-polling workers on enqueue
+LONG_POLL_TIMEOUT = 25.0       # max seconds a /job/next caller may ask to wait
 
 def new_job(prompt, meta=None):
     job_id = uuid.uuid4().hex
@@ -179,42 +516,134 @@ def new_job(prompt, meta=None):
         "worker_id": None,
         "error": None,
     }
-    with JOBS_LOCK:
-        JOBS[job_id] = job
+    if len(JOBS) >= MAX_JOBS:
+        # Full: make room by dropping the oldest finished jobs early, else refuse the job
+        evict_finished_jobs(limit=len(JOBS) - MAX_JOBS + 1)
+        if len(JOBS) >= MAX_JOBS:
+            return None
+    JOB_LOCKS[job_id] = threading.Lock()
+    JOBS[job_id] = job
+    QUEUED.append(job_id)
+    with JOB_CV:
+        JOB_CV.notify()
     return job
 
 
 def next_queued_job_and_claim(worker_id):
-    with JOBS_LOCK:
-        for job in JOBS.values():
+    while True:
+        try:
+            job_id = QUEUED.popleft()
+        except IndexError:
+            return None
+
+        job = JOBS.get(job_id)
+        lock = JOB_LOCKS.get(job_id)
+        if not job or not lock:
+            continue
+        with lock:
             if job["status"] == "queued":
-                job["status"] = "running"
                 job["started_at"] = time.time()
                 job["worker_id"] = worker_id
+                job["status"] = "running"
                 return job
-    return None
 
 
-def update_job_done(job_id, result_filename):
-    with JOBS_LOCK:
-        job = JOBS.get(job_id)
-        if not job:
-            return None
-        job["status"] = "done"
+def update_job_done(job_id, result_filename, url=None):
+    job = JOBS.get(job_id)
+    lock = JOB_LOCKS.get(job_id)
+    if not job or not lock:
+        return None
+    with lock:
         job["finished_at"] = time.time()
-        job["result"] = {"file": result_filename, "url": f"/result/{job_id}"}
-        return job
+        job["result"] = {"file": result_filename, "url": url or f"/result/{job_id}"}
+        job["status"] = "done"
+    FINISHED.append(job_id)
+    return job
 
 
-def update_job_failed(job_id, error_msg):
-    with JOBS_LOCK:
-        job = JOBS.get(job_id)
-        if not job:
+def update_job_failed(job_id, error_msg, only_if=None):
+    """Mark a job failed; with `only_if(job)`, only when it holds under the job's lock."""
+    job = JOBS.get(job_id)
+    lock = JOB_LOCKS.get(job_id)
+    if not job or not lock:
+        return None
+    with lock:
+        if only_if and not only_if(job):
             return None
-        job["status"] = "failed"
         job["finished_at"] = time.time()
         job["error"] = error_msg
-        return job
+        job["status"] = "failed"
+    FINISHED.append(job_id)
+    return job
+
+
+def expire_stale_jobs(now):
+    """Fail jobs stuck in the queue, or claimed by a worker that never reported back."""
+    run_cutoff = now - JOB_RUN_TIMEOUT
+    queue_cutoff = now - JOB_QUEUE_TTL
+    for job_id in list(JOBS):
+        update_job_failed(
+            job_id, "worker timed out",
+            only_if=lambda j: j["status"] == "running" and j["started_at"] < run_cutoff
+        )
+        update_job_failed(
+            job_id, "expired in queue",
+            only_if=lambda j: j["status"] == "queued" and j["created_at"] < queue_cutoff
+        )
+
+
+def _finished_at(job_id, job):
+    lock = JOB_LOCKS.get(job_id)
+    if not lock:
+        return None
+    with lock:
+        if job["status"] in ("done", "failed"):
+            return job["finished_at"]
+    return None
+
+
+def _evict_job(job_id, job):
+    result = job["result"]
+    if result and result["file"]:
+        try:
+            os.unlink(os.path.join(GENERATED_DIR, result["file"]))
+        except OSError:
+            pass
+    JOBS.pop(job_id, None)
+    JOB_LOCKS.pop(job_id, None)
+
+
+def evict_finished_jobs(cutoff=None, limit=None):
+    """Drop finished jobs oldest first: those finished at or before `cutoff`, at most `limit`."""
+    evicted = 0
+    with EVICT_LOCK:
+        while FINISHED and (limit is None or evicted < limit):
+            job_id = FINISHED[0]
+            job = JOBS.get(job_id)
+            finished_at = _finished_at(job_id, job) if job else None
+            if finished_at is None:
+                # Already evicted (a job can be finished twice), drop the stale entry
+                FINISHED.popleft()
+                continue
+            if cutoff is not None and finished_at > cutoff:
+                break
+            FINISHED.popleft()
+            _evict_job(job_id, job)
+            evicted += 1
+    return evicted
+
+
+def _job_janitor():
+    while True:
+        try:
+            expire_stale_jobs(time.time())
+            evict_finished_jobs(cutoff=time.time() - JOB_TTL)
+        except Exception as e:
+            log.warning("job janitor failed: %s", e)
+        time.sleep(60)
+
+
+threading.Thread(target=_job_janitor, daemon=True).start()
 
 
 # ---- API: create job ----
@@ -228,6 +657,8 @@ def generate():
         return jsonify({"error": "missing prompt"}), 400
 
     job = new_job(prompt, meta)
+    if not job:
+        return jsonify({"error": "job queue full"}), 503
     return jsonify({"job_id": job["id"]}), 201
 
 
@@ -250,20 +681,34 @@ def get_result(job_id):
         return jsonify({"error": "result not ready"}), 404
 
     if job["result"]["file"]:
-        return send_from_directory(UPLOAD_DIR, job["result"]["file"], as_attachment=False)
+        return send_from_directory(GENERATED_DIR, job["result"]["file"], as_attachment=False)
     else:
         return jsonify({"url": job["result"]["url"]})
 
 
-# ---- Worker polling endpoint (Kaggle pulls jobs) ----
+# ---- Worker polling endpoint (Kaggle pulls jobs, optional long-poll) ----
 @app.route("/job/next", methods=["POST"])
 def job_next():
     body = request.get_json(force=True) if request.data else {}
     worker_id = body.get("worker_id") or request.remote_addr
 
-    job = next_queued_job_and_claim(worker_id)
-    if not job:
-        return "", 204
+    # Opt-in long-poll: {"wait": seconds} holds the request until a job is
+    # enqueued or the wait expires; the default of 0 answers 204 immediately
+    try:
+        wait = float(body.get("wait") or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "wait must be a number"}), 400
+    wait = min(wait, LONG_POLL_TIMEOUT) if wait > 0 else 0.0
+
+    deadline = time.monotonic() + wait
+    with JOB_CV:
+        job = next_queued_job_and_claim(worker_id)
+        while not job:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return "", 204
+            JOB_CV.wait(timeout=remaining)
+            job = next_queued_job_and_claim(worker_id)
     return jsonify(job), 200
 
 
@@ -278,8 +723,9 @@ def job_complete(job_id):
         f = request.files["model"]
         filename = secure_filename(f.filename)
         out_fname = f"{job_id}__{filename}"
-        out_path = os.path.join(UPLOAD_DIR, out_fname)
-        f.save(out_path)
+        out_path = os.path.join(GENERATED_DIR, out_fname)
+        with open(out_path, "wb") as dst:
+            shutil.copyfileobj(f.stream, dst, length=1 << 20)
         update_job_done(job_id, out_fname)
         return jsonify({"status": "ok", "file": f"/result/{job_id}"}), 200
 
@@ -287,10 +733,7 @@ def job_complete(job_id):
     model_url = body.get("model_url")
 
     if model_url:
-        with JOBS_LOCK:
-            job["status"] = "done"
-            job["finished_at"] = time.time()
-            job["result"] = {"file": None, "url": model_url}
+        update_job_done(job_id, None, url=model_url)
         return jsonify({"status": "ok", "url": model_url}), 200
 
     return jsonify({"error": "no model provided"}), 400
@@ -299,37 +742,42 @@ def job_complete(job_id):
 # ---- list jobs (debug only) ----
 @app.route("/_jobs", methods=["GET"])
 def list_jobs():
-    with JOBS_LOCK:
-        return jsonify(list(JOBS.values())), 200
+    return jsonify(list(JOBS.values())), 200
 
-# app.py
-
-# ... imports and setup ...
 
+# ---- Sketch upload ----
 @app.route("/api/upload-sketch", methods=["POST"])
 def upload_sketch():
+    too_large = image_upload_too_large()
+    if too_large:
+        return too_large
+
     if "sketch" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
 
     file = request.files["sketch"]
     filename = secure_filename(file.filename)
-    save_path = os.path.join("uploads", filename)
-    file.save(save_path)
+    save_path = os.path.join(UPLOAD_DIR, filename)
+    with open(save_path, "wb") as dst:
+        shutil.copyfileobj(file.stream, dst, length=1 << 20)
+    _track_upload(save_path)
 
     # --- 🎯 FIX: Construct the public URL ---
     # `request.host_url` gives the base URL (e.g., "https://stagenix-backend.onrender.com/")
     # The file is served via the /uploads route.
     public_url = f"{request.host_url.rstrip('/')}/uploads/{filename}"
     
-    print("Sketch uploaded and public URL generated:", public_url)
+    log.info("Sketch uploaded and public URL generated: %s", public_url)
 
     return jsonify({
         "status": "ok",
         "sketch_url": public_url # <--- CHANGED KEY NAME for clarity/consistency
     })
 # ================================================================
-# 🎯 RUN APP (unchanged)
+# 🎯 RUN APP (local dev)
 # ================================================================
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    # No reloader: its parent process would import this module too and load
+    # YOLO (and start the worker threads) a second time.
+    app.run(host="0.0.0.0", port=port, debug=True, use_reloader=False)
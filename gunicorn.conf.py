@@ -0,0 +1,16 @@
+# gunicorn.conf.py — picked up automatically by `gunicorn app:app`
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# One process: JOBS, the long-poll Condition and the YOLO batching queue all
+# live in process memory, so a second worker would split the job queue.
+# Threads cover the concurrent I/O routes (/job/next long-poll, /model, /uploads).
+# Deliberately not read from WEB_CONCURRENCY: Heroku-style buildpacks set it.
+workers = 1
+worker_class = "gthread"
+threads = 32
+# The worker imports app.py (YOLO load + warmup) before its first heartbeat, so
+# this must cover a cold model load; the TensorRT/ONNX export is done offline.
+timeout = 120
+keepalive = 5